@@ -7,6 +7,49 @@ import sqlite3
 
 from datalad.support.json_py import load_stream
 
+# schema of the database which tracks the open (scheduled, but not yet
+# finished) slurm jobs
+DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS open_jobs (
+slurm_job_id INTEGER,
+message TEXT,
+chain TEXT CHECK (json_valid(chain)),
+cmd TEXT,
+dsid TEXT,
+inputs TEXT CHECK (json_valid(inputs)),
+extra_inputs TEXT CHECK (json_valid(extra_inputs)),
+outputs TEXT CHECK (json_valid(outputs)),
+slurm_outputs TEXT CHECK (json_valid(slurm_outputs)),
+pwd TEXT
+);
+CREATE TABLE IF NOT EXISTS locked_prefixes (
+slurm_job_id INTEGER,
+prefix TEXT
+);
+CREATE TABLE IF NOT EXISTS locked_names (
+slurm_job_id INTEGER,
+name TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_open_jobs_slurm_job_id
+ON open_jobs(slurm_job_id);
+CREATE INDEX IF NOT EXISTS idx_locked_prefixes_prefix
+ON locked_prefixes(prefix);
+CREATE INDEX IF NOT EXISTS idx_locked_names_name
+ON locked_names(name);
+"""
+
+# columns of the open_jobs table which are stored as json
+JSON_COLUMNS = frozenset(
+    ("chain", "inputs", "extra_inputs", "outputs", "slurm_outputs")
+)
+
+# the message and run record in the commit message of a finished slurm job
+_FINISH_RECORD_RE = re.compile(
+    r"\[DATALAD SLURM RUN\] (.*)=== Do not change lines below "
+    r"===\n(.*)\n\^\^\^ Do not change lines above \^\^\^",
+    re.MULTILINE | re.DOTALL,
+)
+
 
 def get_finish_info(dset, message):
     """
@@ -31,11 +74,7 @@ def get_finish_info(dset, message):
     ValueError
            If message contains invalid JSON or missing command information
     """
-    cmdrun_regex = (
-        r"\[DATALAD SLURM RUN\] (.*)=== Do not change lines below "
-        r"===\n(.*)\n\^\^\^ Do not change lines above \^\^\^"
-    )
-    runinfo = re.match(cmdrun_regex, message, re.MULTILINE | re.DOTALL)
+    runinfo = _FINISH_RECORD_RE.match(message)
     if not runinfo:
         return None, None
 
@@ -66,7 +105,7 @@ def get_finish_info(dset, message):
     return rec_msg.rstrip(), runinfo
 
 
-def connect_to_database(dset, row_factory=False):
+def connect_to_database(dset, row_factory=False, con=None):
     """
     Connect to sqlite3 database and return the connection and cursor.
 
@@ -76,6 +115,9 @@ def connect_to_database(dset, row_factory=False):
            Dataset object with repo and path information
     row_factory : bool, optional
            If True, return single-column results as scalars instead of tuples, default False
+    con : sqlite3.Connection, optional
+           An already open connection to the database. If it is still open,
+           it is returned together with a new cursor instead of connecting again.
 
     Returns
     -------
@@ -85,20 +127,38 @@ def connect_to_database(dset, row_factory=False):
 
     Notes
     -----
-    Database path is constructed from dataset ID and branch in .git directory
+    Database path is constructed from dataset ID and branch in .git directory.
+    Rows are returned as sqlite3.Row, unless `row_factory` is True.
+    The tables (and their indexes) are created on connection if they do not
+    exist yet.
     """
+    if con is not None:
+        try:
+            return con, _get_cursor(con, row_factory)
+        except sqlite3.ProgrammingError:
+            # the connection has been closed already
+            pass
+
     # define the database path from the dataset and branch
-    ds_repo = dset.repo
     db_name = f"{dset.id}.db"
     db_path = dset.pathobj / ".git" / db_name
 
     # try to connect to the database
     try:
         con = sqlite3.connect(db_path)
-        if row_factory:
-            con.row_factory = lambda cursor, row: row[0]
-        cur = con.cursor()
+        # rows can be accessed both by index and by column name
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA temp_store=MEMORY")
+        con.executescript(DB_SCHEMA)
+        cur = _get_cursor(con, row_factory)
     except sqlite3.Error:
         return None, None
 
     return con, cur
+
+
+def _get_cursor(con, row_factory):
+    cur = con.cursor()
+    if row_factory:
+        cur.row_factory = lambda cursor, row: row[0]
+    return cur
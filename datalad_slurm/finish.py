@@ -2,10 +2,12 @@
 
 __docformat__ = "restructuredtext"
 
-import json
+import glob
 import logging
-import subprocess
 import os.path as op
+import re
+import subprocess
+import sys
 
 from datalad.core.local.save import Save
 from datalad.distribution.dataset import (
@@ -26,18 +28,74 @@ from datalad.support.constraints import (
     EnsureStr,
 )
 from datalad.support.globbedpaths import GlobbedPaths
+from datalad.support.locking import (
+    InterProcessLock,
+    try_lock_informatively,
+)
 from datalad.support.param import Parameter
 from datalad.utils import (
     chpwd,
+    getpwd,
     ensure_list,
 )
 
-from .common import connect_to_database
+from .common import (
+    JSON_COLUMNS,
+    connect_to_database,
+)
+
+try:
+    # optional, faster drop-in for decoding the json columns of the database
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 from datalad.core.local.run import _create_record, get_command_pwds
 
 lgr = logging.getLogger("datalad.slurm.finish")
 
+# the SQL statements are kept as constants, so that the statement cache of
+# the (single) connection can be reused for every job
+_SQL_SELECT_OPEN = "SELECT * FROM open_jobs WHERE slurm_job_id = ?"
+_SQL_DEL_OPEN = "DELETE FROM open_jobs WHERE slurm_job_id = ?"
+_SQL_DEL_PREFIXES = "DELETE FROM locked_prefixes WHERE slurm_job_id = ?"
+_SQL_DEL_NAMES = "DELETE FROM locked_names WHERE slurm_job_id = ?"
+
+# template of the commit message of a finished job, parsed by get_finish_info
+_MSG_TEMPLATE = """\
+[DATALAD SLURM RUN] {}
+
+=== Do not change lines below ===
+{}
+^^^ Do not change lines above ^^^
+        """
+
+# a slurm job id, optionally with an array task index or a step name
+_JOB_ID_RE = re.compile(r"[0-9]+(?:_[0-9]+|\.batch|\.extern)?")
+
+# classification of the job states as bit flags: completed jobs set no flag,
+# jobs which are not done yet set the active flag, any other state counts as
+# failed. Besides pending and running jobs, the active states include the
+# transitional ones which only squeue reports, e.g. COMPLETING.
+_STATE_ACTIVE = 1
+_STATE_FAILED = 2
+_STATE_CLASS = {
+    "COMPLETED": 0,
+    "PENDING": _STATE_ACTIVE,
+    "RUNNING": _STATE_ACTIVE,
+    "COMPLETING": _STATE_ACTIVE,
+    "CONFIGURING": _STATE_ACTIVE,
+    "STAGE_OUT": _STATE_ACTIVE,
+    "RESIZING": _STATE_ACTIVE,
+    "SIGNALING": _STATE_ACTIVE,
+    "SUSPENDED": _STATE_ACTIVE,
+    "STOPPED": _STATE_ACTIVE,
+    "REQUEUED": _STATE_ACTIVE,
+    "REQUEUE_FED": _STATE_ACTIVE,
+    "REQUEUE_HOLD": _STATE_ACTIVE,
+    "RESV_DEL_HOLD": _STATE_ACTIVE,
+}
+
 
 class Finish(Interface):
     """Finishes (i.e. saves outputs) a slurm submitted job."""
@@ -134,11 +192,15 @@ class Finish(Interface):
             )
             return
 
-        if slurm_job_id:
-            slurm_job_id_list = [slurm_job_id]
-        else:
-            slurm_job_id_list, status_ok = get_scheduled_commits(ds)
-            if not status_ok:
+        # finish processes of the same dataset run one after another, so that
+        # a job cannot be finished twice and the saves don't compete for the
+        # git index lock
+        lock = InterProcessLock(str(ds.repo.dot_git / "datalad-slurm.lock"))
+        with try_lock_informatively(lock, purpose="finish slurm jobs"):
+            # a single database connection is used for all the jobs, it is
+            # only opened once the lock is held
+            con, _ = connect_to_database(ds)
+            if not con:
                 yield get_status_dict(
                     "slurm-finish",
                     ds=ds,
@@ -147,40 +209,95 @@ class Finish(Interface):
                 )
                 return
 
-        # list the open jobs if requested
-        # if a single commit was specified, nothing happens
-        # TODO: triple list and multiple prints is a bit ugly, consider refactor
-        if list_open_jobs:
-            if slurm_job_id_list:
-                print("The following jobs are open: \n")
-                print(f"{'slurm-job-id':<14} {'slurm-job-status'}")
-                for i, slurm_job_id in enumerate(slurm_job_id_list):
-                    job_status = get_job_status(slurm_job_id)[1]
-                    print(f"{slurm_job_id:<10} {job_status}")
-            return
-        for slurm_job_id in slurm_job_id_list:
-            for r in finish_cmd(
-                slurm_job_id,
-                dataset=dataset,
-                message=message,
-                outputs=outputs,
-                explicit=explicit,
-                close_failed_jobs=close_failed_jobs,
-                jobs=None,
-            ):
-                yield r
-
+            # the finished jobs are removed from the database all at once
+            finished_job_ids = []
+            # the expansions of output patterns are shared between the jobs
+            glob_cache = {}
+            try:
+                if slurm_job_id:
+                    slurm_job_id_list = [slurm_job_id]
+                else:
+                    slurm_job_id_list, _ = get_scheduled_commits(ds, con=con)
+
+                # list the open jobs if requested
+                # if a single commit was specified, nothing happens
+                if list_open_jobs:
+                    if slurm_job_id_list:
+                        # query the states of all jobs at once, and write the
+                        # table in one go
+                        job_statuses = get_job_statuses_bulk(slurm_job_id_list)
+                        lines = [
+                            "The following jobs are open: \n",
+                            f"{'slurm-job-id':<14} {'slurm-job-status'}",
+                        ]
+                        for slurm_job_id in slurm_job_id_list:
+                            job_status = job_statuses.get(str(slurm_job_id))
+                            if job_status is None:
+                                job_status = get_job_status(slurm_job_id)
+                            lines.append(f"{slurm_job_id:<10} {job_status[1]}")
+                        sys.stdout.write("\n".join(lines) + "\n")
+                    return
+                # query the states and database entries of all jobs up-front at once
+                if len(slurm_job_id_list) > 1:
+                    prefetched_statuses = get_job_statuses_bulk(slurm_job_id_list)
+                    prefetched_results = extract_many_from_db(
+                        ds, slurm_job_id_list, con=con
+                    )
+                else:
+                    prefetched_statuses = {}
+                    prefetched_results = {}
+                # the working directory is the same for all the jobs
+                pwd, _ = get_command_pwds(dataset)
+                # the jobs are saved one after another, since every save writes to
+                # the same git index; `jobs` parallelizes the work within each save
+                for slurm_job_id in slurm_job_id_list:
+                    for r in finish_cmd(
+                        slurm_job_id,
+                        dataset=dataset,
+                        message=message,
+                        outputs=outputs,
+                        explicit=explicit,
+                        close_failed_jobs=close_failed_jobs,
+                        jobs=jobs,
+                        prefetched_status=prefetched_statuses.get(str(slurm_job_id)),
+                        prefetched_results=prefetched_results.get(str(slurm_job_id)),
+                        con=con,
+                        finished_job_ids=finished_job_ids,
+                        ds=ds,
+                        pwd=pwd,
+                        glob_cache=glob_cache,
+                    ):
+                        yield r
+            finally:
+                if finished_job_ids:
+                    remove_from_database(ds, finished_job_ids, con=con)
+                con.commit()
+                con.close()
+
+
+def get_scheduled_commits(dset, con=None):
+    """Return the slurm job ids of all open jobs.
 
-def get_scheduled_commits(dset):
-    """Return the slurm job ids of all open jobs."""
-    # connect to the database
-    con, cur = connect_to_database(dset, row_factory=True)
+    Returns
+    -------
+    tuple
+        (list of str or None, bool or None)
+        The job ids and True, or (None, None) if the database connection
+        cannot be established.
+    """
+    # connect to the database, unless a connection is given
+    own_con = con is None
+    con, cur = connect_to_database(dset, con=con)
     if not con or not cur:
         return None, None
 
-    # select the slurm job ids into a list
-    cur.execute("SELECT slurm_job_id FROM open_jobs")
-    slurm_job_ids = cur.fetchall()
+    # select the slurm job ids into a list, iterating the cursor directly
+    # rather than materializing the rows with fetchall() first
+    slurm_job_ids = [
+        str(row[0]) for row in cur.execute("SELECT slurm_job_id FROM open_jobs")
+    ]
+    if own_con:
+        con.close()
 
     return slurm_job_ids, True
 
@@ -193,6 +310,13 @@ def finish_cmd(
     explicit=True,
     close_failed_jobs=False,
     jobs=None,
+    prefetched_status=None,
+    prefetched_results=None,
+    con=None,
+    finished_job_ids=None,
+    ds=None,
+    pwd=None,
+    glob_cache=None,
 ):
     """
     Finalize a SLURM job by saving its outputs to a dataset and making an entry in the git log.
@@ -213,6 +337,30 @@ def finish_cmd(
         If True, closes failed or cancelled jobs. Default is False.
     jobs : int, optional
         Number of parallel jobs to use for saving. Default is None.
+    prefetched_status : tuple, optional
+        The result of `get_job_status` for this job, if it was already
+        queried. Default is None, in which case the job status is queried.
+    prefetched_results : dict, optional
+        The result of `extract_from_db` for this job, if it was already
+        extracted. Default is None, in which case it is read from the database.
+    con : sqlite3.Connection, optional
+        An open connection to the database. Default is None, in which case
+        a new connection is opened. Changes made through a given connection
+        are not committed.
+    finished_job_ids : list, optional
+        If given, the id of the finished (or closed) job is appended to this
+        list, and the caller is responsible for removing it from the database.
+        Default is None, in which case the job is removed right away.
+    ds : Dataset, optional
+        The already resolved dataset. Default is None, in which case it is
+        resolved from `dataset`.
+    pwd : str, optional
+        The directory to save the outputs from. Default is None, in which case
+        it is determined from `dataset`.
+    glob_cache : dict, optional
+        The expansions of output patterns, which are reused and extended.
+        Default is None, in which case the patterns are only expanded for
+        this job.
 
     Yields
     ------
@@ -225,10 +373,13 @@ def finish_cmd(
     processes the outputs, and records the run information. If the job is not complete, it can optionally
     close failed or cancelled jobs.
     """
-    ds = require_dataset(dataset, check_installed=True, purpose="finish a SLURM job")
+    if ds is None:
+        ds = require_dataset(
+            dataset, check_installed=True, purpose="finish a SLURM job"
+        )
     ds_repo = ds.repo
 
-    lgr.debug("rerunning command output underneath %s", ds)
+    lgr.debug("finishing slurm job %s underneath %s", slurm_job_id, ds)
 
     if not explicit:
         yield get_status_dict(
@@ -252,7 +403,10 @@ def finish_cmd(
         return
 
     # get the open jobs from the database
-    results = extract_from_db(ds, slurm_job_id)
+    if prefetched_results is None:
+        results = extract_from_db(ds, slurm_job_id, con=con)
+    else:
+        results = prefetched_results
     if not results:
         yield get_status_dict(
             "slurm-finish",
@@ -263,8 +417,11 @@ def finish_cmd(
 
     run_message = results["run_message"]
     slurm_run_info = results["slurm_run_info"]
-    # concatenate outputs from both submission and completion
-    outputs_to_save = ensure_list(outputs) + ensure_list(slurm_run_info["outputs"])
+    # concatenate outputs from both submission and completion, dropping
+    # the duplicates (but keeping the order)
+    outputs_to_save = list(
+        dict.fromkeys(ensure_list(outputs) + ensure_list(slurm_run_info["outputs"]))
+    )
 
     # should throw an error if user doesn't specify outputs or directory
     if not outputs_to_save:
@@ -275,14 +432,17 @@ def finish_cmd(
     slurm_job_id = slurm_run_info["slurm_job_id"]
 
     # get a list of job ids and status (if we have an array job)
-    job_states, job_status_group = get_job_status(slurm_job_id)
+    if prefetched_status is None:
+        prefetched_status = get_job_status(slurm_job_id)
+    job_states, job_status_group = prefetched_status
 
-    status_text = "Job ID: Job state \n"
-    for job_id, state in job_states.items():
-        status_text += f"{job_id}: {state} \n"
+    # classify the job states in a single pass
+    state_flags = 0
+    for status in job_states.values():
+        state_flags |= _STATE_CLASS.get(status, _STATE_FAILED)
 
     # process these job ids and job statuses
-    if not all(status == "COMPLETED" for status in job_states.values()):
+    if state_flags:
         status_summary = ", ".join(
             f"{job_id}: {status}" for job_id, status in job_states.items()
         )
@@ -290,7 +450,7 @@ def finish_cmd(
             f"Slurm job(s) for job {slurm_job_id} are not complete."
             f"Statuses: {status_summary}"
         )
-        if any(status in ["PENDING", "RUNNING"] for status in job_states.values()):
+        if state_flags & _STATE_ACTIVE:
             yield get_status_dict("slurm-finish", status="impossible", message=message)
             return
         else:
@@ -299,35 +459,22 @@ def finish_cmd(
                 return
             else:
                 # remove the job
-                remove_from_database(ds, slurm_run_info)
+                _remove_job(ds, slurm_job_id, con, finished_job_ids)
                 message = f"Closing failed / cancelled jobs. Statuses: {status_summary}"
                 yield get_status_dict("slurm-finish", status="ok", message=message)
                 return
 
     # expand the wildcards
-    globbed_outputs = GlobbedPaths(outputs_to_save, expand=True).paths
+    globbed_outputs = expand_outputs(outputs_to_save, cache=glob_cache)
 
     # update the run info with the new outputs
     slurm_run_info["outputs"] = globbed_outputs
 
     # TODO: this is not saving model files (outputs from first job) for some reason
-    # rel_pwd = reslurm_run_info.get('pwd') if reslurm_run_info else None
-    rel_pwd = None  # TODO might be able to get this from rerun info
-    if rel_pwd and dataset:
-        # recording is relative to the dataset
-        pwd = op.normpath(op.join(dataset.path, rel_pwd))
-        rel_pwd = op.relpath(pwd, dataset.path)
-    else:
-        pwd, rel_pwd = get_command_pwds(dataset)
+    if pwd is None:
+        pwd, _ = get_command_pwds(dataset)
 
     do_save = True
-    msg = """\
-[DATALAD SLURM RUN] {}
-
-=== Do not change lines below ===
-{}
-^^^ Do not change lines above ^^^
-        """
     job_status_group = job_status_group.capitalize()
     message_entry = f"Slurm job {slurm_job_id}: {job_status_group}"
 
@@ -342,13 +489,13 @@ def finish_cmd(
     # TODO sidecar param
     record, record_path = _create_record(slurm_run_info, False, ds)
 
-    msg = msg.format(
+    msg = _MSG_TEMPLATE.format(
         message_entry,
         '"{}"'.format(record) if record_path else record,
     )
 
     # remove the job
-    remove_from_database(ds, slurm_run_info)
+    _remove_job(ds, slurm_job_id, con, finished_job_ids)
 
     if do_save:
         with chpwd(pwd):
@@ -368,43 +515,119 @@ def finish_cmd(
                 yield r
 
 
-def extract_from_db(dset, slurm_job_id):
+def _remove_job(dset, slurm_job_id, con, finished_job_ids):
+    if finished_job_ids is None:
+        remove_from_database(dset, [slurm_job_id], con=con)
+    else:
+        finished_job_ids.append(slurm_job_id)
+
+
+def expand_outputs(outputs, cache=None):
+    """Expand the wildcards in a list of outputs.
+
+    Absolute paths are made relative to the working directory, as
+    `GlobbedPaths` does. Plain paths are then taken as they are, without
+    accessing the file system. Only patterns with wildcards are globbed.
+
+    Parameters
+    ----------
+    outputs : list of str
+        The outputs to expand.
+    cache : dict, optional
+        The expansions of patterns by (pattern, working directory), which are
+        reused and extended. Default is None, in which case nothing is cached.
+
+    Returns
+    -------
+    list of str
+        The expanded outputs.
+    """
+    if cache is None:
+        cache = {}
+    expanded = []
+    pwd = getpwd()
+    for output in outputs:
+        if op.isabs(output):
+            output = op.relpath(output, start=pwd)
+        if not glob.has_magic(output):
+            expanded.append(output)
+            continue
+        key = (output, pwd)
+        if key not in cache:
+            cache[key] = GlobbedPaths([output], pwd=pwd, expand=True).paths
+        expanded.extend(cache[key])
+    return expanded
+
+
+def extract_from_db(dset, slurm_job_id, con=None):
     """Extract the run info from the database entry."""
-    con, cur = connect_to_database(dset)
+    own_con = con is None
+    con, cur = connect_to_database(dset, con=con)
 
     # select all columns
-    query = "SELECT * FROM open_jobs WHERE slurm_job_id = ?"
-    cur.execute(query, (slurm_job_id,))
+    cur.execute(_SQL_SELECT_OPEN, (slurm_job_id,))
 
     # Fetch the record
     record = cur.fetchone()
+    if own_con:
+        con.close()
 
     if not record:
         return None
 
-    # Get column names from cursor description
-    column_names = [desc[0] for desc in cur.description]
+    return _record_to_result(record)
+
 
-    # extract as dictionary
-    slurm_run_info = dict(zip(column_names, record))
+def extract_many_from_db(dset, slurm_job_ids, con=None):
+    """Extract the run info of several jobs from the database.
+
+    Returns a dictionary with the slurm job ids (as str) as keys and the
+    results, as returned by `extract_from_db`, as values. Jobs which are not
+    in the database are left out.
+    """
+    own_con = con is None
+    con, cur = connect_to_database(dset, con=con)
+
+    results = {}
+    # stay well below the limit on the number of SQL variables
+    chunk_size = 500
+    for i in range(0, len(slurm_job_ids), chunk_size):
+        chunk = slurm_job_ids[i : i + chunk_size]
+        query = "SELECT * FROM open_jobs WHERE slurm_job_id IN ({})".format(
+            ",".join("?" * len(chunk))
+        )
+        for record in cur.execute(query, chunk):
+            res = _record_to_result(record)
+            results[str(res["slurm_run_info"]["slurm_job_id"])] = res
 
-    # convert json columns to list
-    json_columns = ["chain", "inputs", "extra_inputs", "outputs", "slurm_outputs"]
+    if own_con:
+        con.close()
+    return results
 
-    for column in json_columns:
-        slurm_run_info[column] = json.loads(slurm_run_info[column])
 
-    message = slurm_run_info["message"]
-    del slurm_run_info["message"]
+def _record_to_result(record):
+    """Convert a row (sqlite3.Row) of the open_jobs table to a result."""
+    # extract as dictionary, converting the json columns to lists
+    slurm_run_info = {
+        column: (
+            json_loads(record[column]) if column in JSON_COLUMNS else record[column]
+        )
+        for column in record.keys()
+        if column != "message"
+    }
 
-    res = {"run_message": message, "slurm_run_info": slurm_run_info}
+    res = {"run_message": record["message"], "slurm_run_info": slurm_run_info}
 
     return dict(res, status="ok")
 
 
 def get_job_status(job_id):
     """
-    Check the status of a Slurm job using the sacct command.
+    Check the status of a Slurm job.
+
+    The state is queried from the Slurm controller with squeue, which is
+    cheaper than a query of the accounting database. Jobs which are no
+    longer known to the controller are looked up with sacct.
 
     Parameters
     ----------
@@ -432,12 +655,20 @@ def get_job_status(job_id):
     # Convert job_id to string if it's an integer
     job_id = str(job_id)
 
-    # Validate job_id format (should be a positive integer)
-    if not job_id.isdigit():
+    # Validate job_id format (a positive integer, optionally followed by an
+    # array task index or step name, e.g. 12345_7 or 12345.batch)
+    if not _JOB_ID_RE.fullmatch(job_id):
         raise ValueError(
-            f"Invalid job ID: {job_id}. Job ID must be a positive integer."
+            f"Invalid job ID: {job_id}. Job ID must be a positive integer, "
+            "optionally followed by an array task index or step name."
         )
 
+    squeue_states = _group_job_states(_squeue_job_states([job_id]), [job_id]).get(
+        job_id
+    )
+    if squeue_states and not _is_settled_array(job_id, squeue_states):
+        return squeue_states, _get_job_status_group(squeue_states)
+
     try:
         # Run sacct command to get job status
         # -n: no header
@@ -455,60 +686,173 @@ def get_job_status(job_id):
         output = result.stdout.strip()
         # If there's no output, the job doesn't exist
         if not output:
+            if squeue_states:
+                # not (yet) in the accounting database
+                return squeue_states, _get_job_status_group(squeue_states)
             raise ValueError(f"Job {job_id} not found")
 
         # Create dictionary of job_id: state pairs
         job_states = {}
         for line in output.splitlines():
-            job_id, state = line.split("|")
-            if "CANCELLED" in state:
-                state = "CANCELLED"
-            job_states[job_id] = state
-
-        unique_statuses = set(job_states.values())
-        if len(unique_statuses) == 1:
-            job_status_group = unique_statuses.pop()  # Get the single status value
-        else:
-            if "COMPLETED" in unique_statuses:
-                job_status_group = "ARRAY FAILED (SOME COMPLETE)"
-            else:
-                job_status_group = "ARRAY FAILED (MULTIPLE CAUSES)"
+            task_id, state = line.split("|", 1)
+            job_states[task_id] = _normalize_job_state(state)
 
-        return job_states, job_status_group
+        return job_states, _get_job_status_group(job_states)
 
     except subprocess.CalledProcessError as e:
+        if squeue_states:
+            return squeue_states, _get_job_status_group(squeue_states)
         raise RuntimeError(f"Error running sacct command: {e.stderr}")
 
 
-def remove_from_database(dset, slurm_run_info):
-    """Remove a job from the database based on its slurm_job_id."""
-    con, cur = connect_to_database(dset)
+def get_job_statuses_bulk(job_ids):
+    """
+    Check the status of several Slurm jobs at once.
 
-    # Remove the rows matching the slurm_job_id from all the tables
-    cur.execute(
-        """
-    DELETE FROM open_jobs
-    WHERE slurm_job_id = ?
-    """,
-        (slurm_run_info["slurm_job_id"],),
-    )
+    A single squeue call queries all jobs from the Slurm controller, the jobs
+    which are no longer known to the controller are queried with a single
+    sacct call.
 
-    cur.execute(
-        """
-    DELETE FROM locked_prefixes
-    WHERE slurm_job_id = ?
-    """,
-        (slurm_run_info["slurm_job_id"],),
-    )
+    Parameters
+    ----------
+    job_ids : list of Union[str, int]
+        The Slurm job IDs to check.
 
-    cur.execute(
-        """
-    DELETE FROM locked_names
-    WHERE slurm_job_id = ?
-    """,
-        (slurm_run_info["slurm_job_id"],),
+    Returns
+    -------
+    dict
+        A dictionary with the Slurm job IDs (as str) as keys and tuples as
+        returned by `get_job_status` as values. Jobs which are invalid or
+        not found, or all jobs if sacct fails, are left out, so that callers
+        can fall back to `get_job_status` to report the error.
+    """
+    job_ids = [str(job_id) for job_id in job_ids]
+    job_ids = [job_id for job_id in job_ids if _JOB_ID_RE.fullmatch(job_id)]
+    if not job_ids:
+        return {}
+
+    grouped_states = _group_job_states(_squeue_job_states(job_ids), job_ids)
+
+    # arrays whose tasks are all done may lack tasks that the controller
+    # already purged, these are looked up with sacct as well
+    missing_ids = [
+        job_id
+        for job_id in job_ids
+        if job_id not in grouped_states
+        or _is_settled_array(job_id, grouped_states[job_id])
+    ]
+    if missing_ids:
+        try:
+            result = subprocess.run(
+                [
+                    "sacct",
+                    "-n",
+                    "-X",
+                    "-j",
+                    ",".join(missing_ids),
+                    "-o",
+                    "JobID,State",
+                    "--parsable2",
+                ],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            grouped_states.update(
+                _group_job_states(result.stdout.strip().splitlines(), missing_ids)
+            )
+        except (subprocess.CalledProcessError, OSError):
+            pass
+
+    return {
+        job_id: (job_states, _get_job_status_group(job_states))
+        for job_id, job_states in grouped_states.items()
+    }
+
+
+def _is_settled_array(job_id, job_states):
+    """
+    Whether the states are those of an array job without any active task.
+
+    The controller only keeps finished jobs for a while (MinJobAge), so the
+    tasks of such an array reported by squeue may be incomplete.
+    """
+    return any(task_id != job_id for task_id in job_states) and not any(
+        _STATE_CLASS.get(state) == _STATE_ACTIVE for state in job_states.values()
     )
 
-    con.commit()
-    con.close()
+
+def _squeue_job_states(job_ids):
+    """
+    Query the states of Slurm jobs from the Slurm controller.
+
+    Returns the "job id|state" output lines of squeue, or an empty list if
+    squeue is not available or none of the jobs are known to the controller
+    (anymore).
+    """
+    try:
+        result = subprocess.run(
+            ["squeue", "-h", "-t", "all", "-j", ",".join(job_ids), "-o", "%i|%T"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (subprocess.CalledProcessError, OSError):
+        return []
+    return result.stdout.strip().splitlines()
+
+
+def _group_job_states(lines, job_ids):
+    """
+    Group "job id|state" lines by the job id they were requested with.
+
+    States of array tasks are grouped under their array job id, unless the
+    task itself was requested.
+    """
+    requested_ids = set(job_ids)
+    grouped_states = {}
+    for line in lines:
+        task_id, state = line.split("|", 1)
+        if task_id in requested_ids:
+            job_id = task_id
+        else:
+            job_id = task_id.split("_", 1)[0]
+        grouped_states.setdefault(job_id, {})[task_id] = _normalize_job_state(state)
+    return grouped_states
+
+
+def _normalize_job_state(state):
+    """Map e.g. 'CANCELLED by 1000' to 'CANCELLED'."""
+    if state.startswith("CANCELLED"):
+        return "CANCELLED"
+    return state
+
+
+def _get_job_status_group(job_states):
+    """Summarize the states of (array) job tasks into a single status."""
+    unique_statuses = set(job_states.values())
+    if len(unique_statuses) == 1:
+        return unique_statuses.pop()  # Get the single status value
+    if "COMPLETED" in unique_statuses:
+        return "ARRAY FAILED (SOME COMPLETE)"
+    return "ARRAY FAILED (MULTIPLE CAUSES)"
+
+
+def remove_from_database(dset, slurm_job_ids, con=None):
+    """Remove jobs from the database based on their slurm_job_id.
+
+    If an open connection `con` is given, the removal is not committed.
+    """
+    own_con = con is None
+    con, cur = connect_to_database(dset, con=con)
+
+    # Remove the rows matching the slurm_job_ids from all the tables
+    slurm_job_ids = [(slurm_job_id,) for slurm_job_id in slurm_job_ids]
+    cur.executemany(_SQL_DEL_OPEN, slurm_job_ids)
+    cur.executemany(_SQL_DEL_PREFIXES, slurm_job_ids)
+    cur.executemany(_SQL_DEL_NAMES, slurm_job_ids)
+
+    if own_con:
+        con.commit()
+        con.close()
     return
@@ -14,7 +14,10 @@ import os.path as op
 import re
 import sys
 from copy import copy
-from functools import partial
+from functools import (
+    lru_cache,
+    partial,
+)
 from itertools import dropwhile
 
 from datalad.consts import PRE_INIT_COMMIT_SHA
@@ -35,7 +38,11 @@ from datalad.support.constraints import (
     EnsureNone,
     EnsureStr,
 )
-from datalad.support.exceptions import CapturedException
+from datalad.support.exceptions import (
+    CapturedException,
+    CommandError,
+)
+from datalad.support.gitrepo import GitRepo
 from datalad.support.param import Parameter
 
 from datalad.core.local.run import (
@@ -51,6 +58,13 @@ from .common import get_finish_info
 
 lgr = logging.getLogger("datalad.local.reschedule")
 
+# the job status line of a scheduled job in the message of a commit
+_JOB_PATTERN = re.compile(r"Submitted batch job \d+: Pending")
+
+# below this number of commits in the range, writing a commit-graph costs
+# more than it saves in the ancestry checks of the rerun
+_COMMIT_GRAPH_MIN_COMMITS = 100
+
 reschedule_assume_ready_opt = copy(assume_ready_opt)
 reschedule_assume_ready_opt._doc += """
 Note that this option also affects any additional outputs that are
@@ -187,7 +201,8 @@ class Reschedule(Interface):
 
         lgr.debug("rescheduling command output underneath %s", ds)
 
-        if not ds_repo.get_hexsha():
+        head_hexsha, active_branch = _get_head_info(ds_repo)
+        if not head_hexsha:
             yield get_status_dict(
                 "slurm-reschedule",
                 ds=ds,
@@ -201,29 +216,34 @@ class Reschedule(Interface):
 
         # get branch
         rev_branch = (
-            ds_repo.get_corresponding_branch() or ds_repo.get_active_branch() or "HEAD"
+            (active_branch and ds_repo.get_corresponding_branch(active_branch))
+            or active_branch
+            or "HEAD"
         )
 
         if revision is None:
             revision = rev_branch
 
-        if not ds_repo.commit_exists(revision + "^"):
-            # Only a single commit is reachable from `revision`.  In
-            # this case, --since has no effect on the range construction.
-            revrange = revision
-        elif since is None:
-            revrange = "{rev}^..{rev}".format(rev=revision)
+        if since is None:
+            if ds_repo.commit_exists(revision + "^"):
+                revrange = "{rev}^..{rev}".format(rev=revision)
+            else:
+                # Only a single commit is reachable from `revision`.
+                revrange = revision
         elif since.strip() == "":
             revrange = revision
         else:
             revrange = "{}..{}".format(since, revision)
 
-        results = _rerun_as_results(ds, revrange, since, message, rev_branch)
+        results = _rerun_as_results(
+            ds, revrange, since, message, rev_branch, with_author=report and not script
+        )
         if script:
             handler = _get_script_handler(script, since, revision)
         elif report:
             handler = _report
         else:
+            _ensure_commit_graph(ds_repo, revrange)
             handler = partial(
                 _rerun, assume_ready=assume_ready, explicit=True, jobs=jobs
             )
@@ -232,7 +252,50 @@ class Reschedule(Interface):
             yield res
 
 
-def _revrange_as_results(dset, revrange):
+def _get_head_info(ds_repo):
+    """Return the hexsha of HEAD and the active branch with a single git call.
+
+    The branch is None for a detached HEAD, and both are None if there are
+    no commits yet.
+    """
+    try:
+        out = ds_repo.call_git(
+            ["rev-parse", "HEAD", "--symbolic-full-name", "HEAD"],
+            expect_fail=True,
+            read_only=True,
+        )
+    except CommandError:
+        return None, None
+    hexsha, ref = out.split()
+    branch = ref[11:] if ref.startswith("refs/heads/") else None
+    return hexsha, branch
+
+
+def _ensure_commit_graph(ds_repo, revrange):
+    """Write a commit-graph file for reruns of a large range of commits.
+
+    The generation numbers in the commit-graph speed up the ancestry checks
+    of the rerun. Commits added later are still found without the graph.
+    Nothing is written if the repository has a commit-graph already, either
+    a single file or a split one, or if the range is small.
+    """
+    info = ds_repo.dot_git / "objects" / "info"
+    if (info / "commit-graph").exists() or (info / "commit-graphs").exists():
+        return
+    try:
+        n_commits = int(
+            ds_repo.call_git_oneline(
+                ["rev-list", "--count", revrange], read_only=True
+            )
+        )
+        if n_commits < _COMMIT_GRAPH_MIN_COMMITS:
+            return
+        ds_repo.call_git(["commit-graph", "write", "--reachable"])
+    except CommandError as exc:
+        lgr.debug("Could not write commit-graph: %s", CapturedException(exc))
+
+
+def _revrange_as_results(dset, revrange, with_author=False, skip_until_run=False):
     """
     Generate results for a given revision range in a dataset.
 
@@ -242,6 +305,11 @@ def _revrange_as_results(dset, revrange):
         The dataset object containing the repository.
     revrange : str
         The revision range to process.
+    with_author : bool, optional
+        If True, the author name and date of each commit are included.
+    skip_until_run : bool, optional
+        If True, no results are generated for the commits before the first
+        commit with run information.
 
     Yields
     ------
@@ -254,6 +322,8 @@ def _revrange_as_results(dset, revrange):
         - 'parents': The parent commits of the commit.
         - 'slurm_run_info': The run information if available.
         - 'run_message': The run message if available.
+        - 'merge_message': The message of a merge commit.
+        - 'author', 'date': The author name and ISO date, if `with_author`.
 
     Raises
     ------
@@ -261,20 +331,37 @@ def _revrange_as_results(dset, revrange):
         If there is an error processing the commit message.
     """
     ds_repo = dset.repo
-    rev_lines = ds_repo.get_revisions(
-        revrange, fmt="%H %P", options=["--reverse", "--topo-order"]
+    # the hexsha, parents, author, date and message of all commits come from
+    # a single git log call, as NUL-separated "hexsha parents", author name,
+    # author date and message items, so nothing is looked up per commit
+    items = ds_repo.call_git_items_(
+        [
+            "log",
+            "-z",
+            "--format=%H %P%x00%an%x00%aI%x00%B",
+            "--reverse",
+            "--topo-order",
+            revrange,
+            "--",
+        ],
+        read_only=True,
+        sep="\0",
     )
-    if not rev_lines:
-        return
 
-    for rev_line in rev_lines:
+    for rev_line, author, date, full_msg in zip(items, items, items, items):
+        if skip_until_run:
+            # leading commits without a finish record are skipped before
+            # their message is parsed
+            if not full_msg.startswith("[DATALAD SLURM RUN] "):
+                continue
+            skip_until_run = False
         # The strip() below is necessary because, with the format above, a
-        # commit without any parent has a trailing space. (We could also use a
-        # custom `rev-list --parents ...` call to avoid this.)
+        # commit without any parent has a trailing space.
         fields = rev_line.strip().split(" ")
         rev, parents = fields[0], fields[1:]
         res = get_status_dict("slurm-reschedule", ds=dset, commit=rev, parents=parents)
-        full_msg = ds_repo.format_commit("%B", rev)
+        if with_author:
+            res["author"], res["date"] = author, date
         try:
             msg, info = get_finish_info(dset, full_msg)
         except ValueError as exc:
@@ -292,10 +379,13 @@ def _revrange_as_results(dset, revrange):
                 continue
             res["slurm_run_info"] = info
             res["run_message"] = msg
+        elif len(parents) > 1:
+            # the message is needed again if the merge is rerun
+            res["merge_message"] = full_msg
         yield dict(res, status="ok")
 
 
-def _rerun_as_results(dset, revrange, since, message, rev_branch):
+def _rerun_as_results(dset, revrange, since, message, rev_branch, with_author=False):
     """
     Represent the rerun as result records.
 
@@ -311,6 +401,8 @@ def _rerun_as_results(dset, revrange, since, message, rev_branch):
         The message to use for the rerun commits.
     rev_branch : str
         The branch to use for the rerun commits.
+    with_author : bool, optional
+        If True, the author name and date of each commit are included.
 
     Yields
     ------
@@ -319,21 +411,33 @@ def _rerun_as_results(dset, revrange, since, message, rev_branch):
         specified revision range. Each dictionary contains information about
         the rerun action, status, and any relevant messages or exceptions.
     """
+    # Drop any leading commits that don't have a run command. These would be
+    # skipped anyways, and their messages are not even parsed. The messages of
+    # the remaining commits are all parsed before anything is rerun, so that
+    # an invalid record does not stop a rerun halfway through.
+    # TODO: change the "slurm_run_info" to something else e.g. "slurm_slurm_run_info"
+    # then there is less chance to be confused with a datalad run command
     try:
-        results = _revrange_as_results(dset, revrange)
+        results = list(
+            dropwhile(
+                lambda r: "slurm_run_info" not in r,
+                _revrange_as_results(
+                    dset, revrange, with_author=with_author, skip_until_run=True
+                ),
+            )
+        )
     except ValueError as exc:
         ce = CapturedException(exc)
         yield get_status_dict(
-            "slurm-reschedule", status="error", message=str(ce), exception=ce
+            "slurm-reschedule",
+            status="error",
+            # a tuple, like all rerun messages, as _rerun logs it formatted
+            message=("%s", ce),
+            exception=ce,
         )
         return
 
     ds_repo = dset.repo
-    # Drop any leading commits that don't have a run command. These would be
-    # skipped anyways.
-    # TODO: change the "slurm_run_info" to something else e.g. "slurm_slurm_run_info"
-    # then there is less chance to be confused with a datalad run command
-    results = list(dropwhile(lambda r: "slurm_run_info" not in r, results))
     if not results:
         yield get_status_dict(
             "slurm-reschedule",
@@ -403,6 +507,13 @@ def _rerun(dset, results, assume_ready=None, explicit=True, jobs=None):
     It maintains a map from original commit hashes to new commit hashes created during the rerun process.
     """
     ds_repo = dset.repo
+
+    # All the revisions compared are hexshas, and the ancestry of two
+    # commits never changes, so the answers can be reused for the whole rerun
+    @lru_cache(maxsize=1024)
+    def is_ancestor(reva, revb):
+        return ds_repo.is_ancestor(reva, revb)
+
     # Keep a map from an original hexsha to a new hexsha created by the rerun
     # (i.e. a reran, cherry-picked, or merged commit).
     new_bases = {}  # original hexsha => reran hexsha
@@ -437,27 +548,27 @@ def _rerun(dset, results, assume_ready=None, explicit=True, jobs=None):
             continue
 
         if rerun_action == "merge":
+            merge_message = res.pop("merge_message")
             old_parents = res["parents"]
             new_parents = [new_bases.get(p, p) for p in old_parents]
             if old_parents == new_parents:
-                if not ds_repo.is_ancestor(res_hexsha, head):
+                if not is_ancestor(res_hexsha, head):
                     ds_repo.checkout(res_hexsha)
             elif res_hexsha != head:
-                if ds_repo.is_ancestor(res_hexsha, onto):
+                if is_ancestor(res_hexsha, onto):
                     new_parents = [
-                        p for p in new_parents if not ds_repo.is_ancestor(p, onto)
+                        p for p in new_parents if not is_ancestor(p, onto)
                     ]
                 if new_parents:
                     if new_parents[0] != head:
                         # Keep the direction of the original merge.
                         ds_repo.checkout(new_parents[0])
                     if len(new_parents) > 1:
-                        msg = ds_repo.format_commit("%B", res_hexsha)
                         ds_repo.call_git(
                             [
                                 "merge",
                                 "-m",
-                                msg,
+                                merge_message,
                                 "--no-ff",
                                 "--allow-unrelated-histories",
                             ]
@@ -479,7 +590,7 @@ def _rerun(dset, results, assume_ready=None, explicit=True, jobs=None):
             if new_base != head:
                 ds_repo.checkout(new_base)
                 head_to_restore, head = head, new_base
-        elif parent != head and ds_repo.is_ancestor(onto, parent):
+        elif parent != head and is_ancestor(onto, parent):
             if rerun_action == "run":
                 ds_repo.checkout(parent)
                 head = parent
@@ -494,7 +605,7 @@ def _rerun(dset, results, assume_ready=None, explicit=True, jobs=None):
         # We've adjusted base. Now skip, pick, or run the commit.
 
         if rerun_action == "skip-or-pick":
-            if ds_repo.is_ancestor(res_hexsha, head):
+            if is_ancestor(res_hexsha, head):
                 _mark_nonrun_result(res, "skip")
                 if head_to_restore:
                     ds_repo.checkout(head_to_restore)
@@ -519,17 +630,29 @@ def _rerun(dset, results, assume_ready=None, explicit=True, jobs=None):
             # addition/not-in-place-modification for now
             auto_outputs = (ap["path"] for ap in new_or_modified(res["diff"]))
             outputs = slurm_run_info.get("outputs", [])
-            outputs_dir = op.join(dset.path, slurm_run_info["pwd"])
+            outputs_set = set(outputs)
+            outputs_dir = op.normpath(op.join(dset.path, slurm_run_info["pwd"]))
+            # the diff paths underneath the outputs dir are made relative by
+            # stripping the prefix, only other paths need op.relpath
+            outputs_prefix = outputs_dir.rstrip(op.sep) + op.sep
             auto_outputs = [
                 p
                 for p in auto_outputs
                 # run records outputs relative to the "pwd" field.
-                if op.relpath(p, outputs_dir) not in outputs
+                if (
+                    p[len(outputs_prefix) :]
+                    if p.startswith(outputs_prefix)
+                    else op.relpath(p, outputs_dir)
+                )
+                not in outputs_set
             ]
 
             # remove the slurm outputs from the previous run from the outputs
-            old_slurm_outputs = slurm_run_info.get("slurm_outputs", [])
-            outputs = [output for output in outputs if output not in old_slurm_outputs]
+            old_slurm_outputs = set(slurm_run_info.get("slurm_outputs", []))
+            if old_slurm_outputs:
+                outputs = [
+                    output for output in outputs if output not in old_slurm_outputs
+                ]
 
             message = res["rerun_message"] or res["run_message"]
             message = check_job_pattern(message)
@@ -582,13 +705,16 @@ def _get_rerun_log_msg(res):
 def _report(dset, results):
     ds_repo = dset.repo
     for res in results:
+        # only needed to rerun merges
+        res.pop("merge_message", None)
         if "slurm_run_info" in res:
             if res["status"] != "impossible":
                 res["diff"] = list(res["diff"])
                 # Add extra information that is useful in the report but not
-                # needed for the rerun.
-                out = ds_repo.format_commit("%an%x00%aI", res["commit"])
-                res["author"], res["date"] = out.split("\0")
+                # needed for the rerun, unless it was read with the commits.
+                if "author" not in res:
+                    out = ds_repo.format_commit("%an%x00%aI", res["commit"])
+                    res["author"], res["date"] = out.split("\0")
         yield res
 
 
@@ -622,7 +748,8 @@ def _get_script_handler(script, since, revision):
 #   datalad rerun --script={script}{since} {revision}
 #
 # in {ds}{path}\n"""
-        ofh.write(
+        # the script is assembled in memory and written at once
+        lines = [
             header.format(
                 script=script,
                 since="" if since is None else " --since=" + since,
@@ -630,40 +757,59 @@ def _get_script_handler(script, since, revision):
                 ds="dataset {} at ".format(dset.id) if dset.id else "",
                 path=dset.path,
             )
-        )
+        ]
 
+        def add_commands(run_results):
+            # describe all the commits with a single git call
+            commit_descrs = _describe_commits(
+                ds_repo, [res["commit"] for res in run_results]
+            )
+
+            for res in run_results:
+                slurm_run_info = res["slurm_run_info"]
+                cmd = slurm_run_info["cmd"]
+
+                expanded_cmd = format_command(
+                    dset,
+                    cmd,
+                    **dict(
+                        slurm_run_info,
+                        dspath=dset.path,
+                        pwd=op.join(dset.path, slurm_run_info["pwd"]),
+                    ),
+                )
+
+                msg = res["run_message"]
+                if msg == _format_cmd_shorty(expanded_cmd):
+                    msg = ""
+
+                lines.append(
+                    "\n" + "".join("# " + ln for ln in msg.splitlines(True)) + "\n"
+                )
+                commit_descr = commit_descrs.get(res["commit"])
+                lines.append(
+                    "# (record: {})\n".format(
+                        commit_descr if commit_descr else res["commit"]
+                    )
+                )
+
+                lines.append(expanded_cmd + "\n")
+
+        run_results = []
         for res in results:
             if res["status"] != "ok":
+                # still write the commands of the commits before this one
+                add_commands(run_results)
+                ofh.write("".join(lines))
                 yield res
                 return
 
             if "slurm_run_info" not in res:
                 continue
+            run_results.append(res)
 
-            slurm_run_info = res["slurm_run_info"]
-            cmd = slurm_run_info["cmd"]
-
-            expanded_cmd = format_command(
-                dset,
-                cmd,
-                **dict(
-                    slurm_run_info, dspath=dset.path, pwd=op.join(dset.path, slurm_run_info["pwd"])
-                ),
-            )
-
-            msg = res["run_message"]
-            if msg == _format_cmd_shorty(expanded_cmd):
-                msg = ""
-
-            ofh.write("\n" + "".join("# " + ln for ln in msg.splitlines(True)) + "\n")
-            commit_descr = ds_repo.describe(res["commit"])
-            ofh.write(
-                "# (record: {})\n".format(
-                    commit_descr if commit_descr else res["commit"]
-                )
-            )
-
-            ofh.write(expanded_cmd + "\n")
+        add_commands(run_results)
+        ofh.write("".join(lines))
         if ofh is not sys.stdout:
             ofh.close()
 
@@ -681,6 +827,31 @@ def _get_script_handler(script, since, revision):
     return fn
 
 
+def _describe_commits(ds_repo, commits):
+    """Describe several commits with `git describe`, in one call per chunk.
+
+    Returns a dictionary with the commits as keys and their descriptions as
+    values. Commits which cannot be described are left out.
+    """
+    commit_descrs = {}
+    # stay well below the limit on the length of the command line
+    chunk_size = 500
+    for i in range(0, len(commits), chunk_size):
+        chunk = commits[i : i + chunk_size]
+        try:
+            # with --always, commits without a tag are described by their
+            # abbreviated hexsha, instead of failing the whole call
+            out = ds_repo.call_git(
+                ["describe", "--always"] + chunk, expect_fail=True, read_only=True
+            )
+        except CommandError:
+            continue
+        for commit, descr in zip(chunk, out.splitlines()):
+            if not commit.startswith(descr):
+                commit_descrs[commit] = descr
+    return commit_descrs
+
+
 def diff_revision(dataset, revision="HEAD"):
     """Yield files that have been added or modified in `revision`.
 
@@ -692,7 +863,8 @@ def diff_revision(dataset, revision="HEAD"):
 
     Returns
     -------
-    Generator that yields AnnotatePaths instances
+    Generator that yields diff result records with (at least) the `path`,
+    `type` and `state` of each changed file
     """
     if dataset.repo.commit_exists(revision + "^"):
         fr = revision + "^"
@@ -701,19 +873,67 @@ def diff_revision(dataset, revision="HEAD"):
         # with an empty tree instead.
         fr = PRE_INIT_COMMIT_SHA
 
-    def changed(res):
-        return res.get("action") == "diff" and res.get("state") != "clean"
+    # git diff-tree without rename detection only compares the trees, and
+    # never needs to look at the (possibly annexed) file content
+    yield from _diff_tree(dataset.repo, fr, revision, dataset.path)
 
-    diff = dataset.diff(
-        recursive=True,
-        fr=fr,
-        to=revision,
-        result_filter=changed,
-        return_type="generator",
-        result_renderer="disabled",
+
+# the file type of a git tree entry, by its mode
+_GIT_MODE_TYPES = {"100644": "file", "100755": "file", "120000": "symlink"}
+_GIT_SUBMODULE_MODE = "160000"
+_GIT_NULL_SHA = "0" * 40
+_DIFF_STATES = {"A": "added", "D": "deleted", "M": "modified", "T": "modified"}
+
+
+def _diff_tree(repo, fr, to, refds):
+    """Yield the changes between two commits of a repository.
+
+    Changes within installed subdatasets are included recursively.
+    """
+    items = repo.call_git_items_(
+        ["diff-tree", "-r", "-z", "--no-renames", fr, to, "--"],
+        read_only=True,
+        sep="\0",
     )
-    for r in diff:
-        yield r
+    for info, path in zip(items, items):
+        old_mode, new_mode, old_sha, new_sha, status = info.lstrip(":").split(" ")
+        mode = old_mode if status == "D" else new_mode
+        path = op.join(repo.path, path)
+        if mode == _GIT_SUBMODULE_MODE:
+            yield get_status_dict(
+                "diff",
+                path=path,
+                type="dataset",
+                state=_DIFF_STATES.get(status, "modified"),
+                parentds=repo.path,
+                refds=refds,
+                status="ok",
+            )
+            if status != "D" and op.exists(op.join(path, ".git")):
+                yield from _diff_subdataset(path, old_sha, new_sha, refds)
+            continue
+        yield get_status_dict(
+            "diff",
+            path=path,
+            type=_GIT_MODE_TYPES.get(mode, "file"),
+            state=_DIFF_STATES.get(status, "modified"),
+            gitshasum=None if status == "D" else new_sha,
+            prev_gitshasum=None if status == "A" else old_sha,
+            parentds=repo.path,
+            refds=refds,
+            status="ok",
+        )
+
+
+def _diff_subdataset(path, old_sha, new_sha, refds):
+    """Yield the changes between two recorded commits of a subdataset."""
+    if old_sha == _GIT_NULL_SHA:
+        old_sha = PRE_INIT_COMMIT_SHA
+    try:
+        yield from _diff_tree(GitRepo(path), old_sha, new_sha, refds)
+    except CommandError as exc:
+        # the recorded commits are not available in the installed subdataset
+        lgr.debug("Cannot diff subdataset %s: %s", path, CapturedException(exc))
 
 
 def new_or_modified(diff_results):
@@ -729,8 +949,7 @@ def new_or_modified(diff_results):
 
 def check_job_pattern(text):
     r"""Check if the text contains a slurm job id and remove it."""
-    pattern = r"Submitted batch job \d+: Pending"
-    match = re.search(pattern, text)
+    match = _JOB_PATTERN.search(text)
 
     if not match:
         return text
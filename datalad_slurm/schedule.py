@@ -13,12 +13,13 @@ import json
 import logging
 import os
 import subprocess
-import re
+import shlex
 import os.path as op
 from argparse import REMAINDER
 from pathlib import Path
 from tempfile import mkdtemp
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 
 import datalad
 from datalad.distribution.dataset import (
@@ -47,21 +48,37 @@ from datalad.support.param import Parameter
 from datalad.ui import ui
 from datalad.utils import ensure_list
 
-from datalad.core.local.run import (
-    _format_cmd_shorty,
-    get_command_pwds,
-    _display_basic,
-    _prep_worktree,
-    format_command,
-    normalize_command,
-    _format_iospecs,
-    _get_substitutions,
-)
+try:
+    # optional, faster drop-in for encoding the json columns of the database
+    from orjson import dumps as _orjson_dumps
+
+    def json_dumps(obj):
+        return _orjson_dumps(obj).decode("utf-8")
 
-from .common import connect_to_database
+except ImportError:
+    # compact, like orjson, and a single encoder instead of one per call
+    json_dumps = json.JSONEncoder(separators=(",", ":")).encode
+
+from .common import (
+    JSON_COLUMNS,
+    connect_to_database,
+)
 
 lgr = logging.getLogger("datalad.slurm.schedule")
 
+# commands with any of these characters need a shell to be executed
+_SHELL_CHARS = frozenset("|&;<>()$`*?[]{}~#\n")
+# maximal number of parallel `scontrol show job` calls for the tasks of an array
+_SCONTROL_WORKERS = 8
+# keys of the `scontrol show job` output which are not recorded
+# TODO Is this necessary for privacy purposes?
+# What is useful to oneself vs for the community when pushing to git
+_EXCLUDED_SLURM_KEYS = frozenset(("UserId", "JobId"))
+# outputs with any of these characters are rejected as wildcards
+_WILDCARD_CHARS = frozenset("*?[]!^{}")
+# the line of the output of sbatch (without --parsable) with the job id
+_SUBMITTED_PREFIX = "Submitted batch job "
+
 assume_ready_opt = Parameter(
     args=("--assume-ready",),
     constraints=EnsureChoice(None, "inputs", "outputs", "both"),
@@ -263,6 +280,8 @@ class Schedule(Interface):
         dry_run = kwargs.get("dry_run")
         if dry_run and "dry_slurm_run_info" in res:
             if dry_run == "basic":
+                from datalad.core.local.run import _display_basic
+
                 _display_basic(res)
             elif dry_run == "command":
                 ui.message(res["dry_slurm_run_info"]["cmd_expanded"])
@@ -295,6 +314,20 @@ class Schedule(Interface):
             generic_result_renderer(res)
 
 
+def _parse_submitted_job_id(output):
+    """Return the job id from the output of sbatch, or None if there is none
+
+    Typical output: "Submitted batch job 123456", possibly preceded by
+    warnings, so the lines are searched from the end.
+    """
+    for line in reversed(output.splitlines()):
+        if line.startswith(_SUBMITTED_PREFIX):
+            # e.g. "123456 on cluster name" with multiple clusters
+            job_id = line[len(_SUBMITTED_PREFIX) :].partition(" ")[0].strip()
+            return job_id if job_id.isdigit() else None
+    return None
+
+
 def _execute_slurm_command(command, pwd):
     """Execute a Slurm submission command and create a job tracking file.
 
@@ -308,45 +341,63 @@ def _execute_slurm_command(command, pwd):
     Returns
     -------
     tuple
-        (exit_code, exception)
-        exit_code is 0 on success, exception is None on success
+        (exit_code, exception, job_id)
+        exit_code is the exit code of the command, exception is None on
+        success, job_id is None if it could not be determined
     """
     exc = None
     cmd_exitcode = None
+    job_id = None
+
+    # a plain sbatch call is run without a shell, and with --parsable so
+    # that it only prints the job id; anything else goes through the shell
+    argv = None
+    if not _SHELL_CHARS.intersection(command):
+        try:
+            argv = shlex.split(command)
+        except ValueError:
+            # e.g. unbalanced quotes, left to the shell to report
+            argv = None
+        if argv and op.basename(argv[0]) == "sbatch":
+            # the option has to come before the script, whose own arguments
+            # follow it
+            argv.insert(1, "--parsable")
+        else:
+            argv = None
 
     try:
         lgr.info("== Slurm submission start (output follows) =====")
         # Run the command and capture output
-        result = subprocess.run(
-            command, shell=True, capture_output=True, text=True, cwd=pwd
-        )
-
-        # Extract job ID from Slurm output
-        # Typical output: "Submitted batch job 123456"
-        stdout = result.stdout
-        match = re.search(r"Submitted batch job (\d+)", stdout)
-
-        # if match and save_tracking_file:
-        #     job_id = match.group(1)
-        #     # Create job tracking file
-        #     tracking_file = os.path.join(pwd, f"slurm-job-submission-{job_id}")
-        #     try:
-        #         with open(tracking_file, 'w') as f:
-        #             # Could add additional metadata here if needed
-        #             pass
-        #         lgr.info(f"Created tracking file: {tracking_file}")
-        #     except IOError as e:
-        #         lgr.warning(f"Failed to create tracking file: {e}")
-        #         # Don't fail the command just because tracking file creation failed
-        # else:
-        #     lgr.warning("Could not extract job ID from Slurm output")
-
-        if match:
-            job_id = match.group(1)
+        if argv:
+            with subprocess.Popen(
+                argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=pwd
+            ) as proc:
+                out, err = proc.communicate()
+            cmd_exitcode = proc.returncode
+            # only the first line is needed,
+            # typical output: "123456" or "123456;cluster"
+            first_line = out.decode("ascii", "replace").partition("\n")[0]
+            job_id = first_line.strip().split(";", 1)[0]
+            if not job_id.isdigit():
+                job_id = None
         else:
+            # not decoded as text by subprocess, warnings printed by sbatch
+            # need not be valid in the locale's encoding
+            result = subprocess.run(command, shell=True, capture_output=True, cwd=pwd)
+            out, err = result.stdout, result.stderr
+            cmd_exitcode = result.returncode
+            job_id = _parse_submitted_job_id(out.decode("utf-8", "replace"))
+
+        if cmd_exitcode:
+            lgr.error(
+                "Command failed with exit code %s: %s",
+                cmd_exitcode,
+                err.decode("utf-8", "replace").strip(),
+            )
+        elif not job_id:
             lgr.warning("Could not extract job ID from Slurm output")
 
-    except subprocess.SubprocessError as e:
+    except (subprocess.SubprocessError, OSError) as e:
         exc = e
         cmd_exitcode = e.returncode if hasattr(e, "returncode") else 1
         lgr.error(f"Command failed with exit code {cmd_exitcode}")
@@ -428,6 +479,18 @@ def schedule_cmd(
     ------
     Result records for the run.
     """
+    # imported here rather than at module level, it pulls in most of datalad
+    # core, which is not needed to build the command line interface
+    from datalad.core.local.run import (
+        _format_cmd_shorty,
+        get_command_pwds,
+        _prep_worktree,
+        format_command,
+        normalize_command,
+        _format_iospecs,
+        _get_substitutions,
+    )
+
     if not cmd:
         lgr.warning("No command given")
         return
@@ -484,8 +547,7 @@ def schedule_cmd(
             )
             return
 
-    wildcard_list = ["*", "?", "[", "]", "!", "^", "{", "}"]
-    if any(char in output for char in wildcard_list for output in outputs):
+    if any(_WILDCARD_CHARS.intersection(output) for output in outputs):
         yield get_status_dict(
             "slurm-schedule",
             ds=ds,
@@ -655,13 +717,29 @@ def schedule_cmd(
     # TODO what happens in case of inject??
     if not inject:
         cmd_exitcode, exc, slurm_job_id = _execute_slurm_command(cmd_expanded, pwd)
+        if slurm_job_id is None:
+            # without a job id there are no output files to look up and no
+            # job to register
+            yield get_status_dict(
+                "slurm-schedule",
+                ds=ds,
+                status="error",
+                message=(
+                    "Job submission failed, no slurm job id could be "
+                    "determined (exit code %s)",
+                    cmd_exitcode,
+                ),
+                exit_code=cmd_exitcode,
+                exception=exc,
+            )
+            return
         slurm_run_info["exit"] = cmd_exitcode
         # TODO: expand these paths
         slurm_outputs, slurm_env_file = get_slurm_output_files(slurm_job_id)
-        slurm_run_info["outputs"].extend(slurm_outputs)
-        slurm_run_info["outputs"].append(slurm_env_file)
+        # the log files and the environment file of the job, in this order
+        slurm_outputs.append(slurm_env_file)
         slurm_run_info["slurm_outputs"] = slurm_outputs
-        slurm_run_info["slurm_outputs"].append(slurm_env_file)
+        slurm_run_info["outputs"].extend(slurm_outputs)
 
     # add the slurm job id to the run info
     slurm_run_info["slurm_job_id"] = slurm_job_id
@@ -670,15 +748,14 @@ def schedule_cmd(
     #
     # TODO: If a warning or error is desired when an --output pattern doesn't
     # have a match, this would be the spot to do it.
-    if explicit or expand in ["outputs", "both"]:
-        # also for explicit mode we have to re-glob to be able to save all
-        # matching outputs
+    # Unlike `run`, nothing is saved here (that is up to `finish`), so the
+    # outputs only need to be re-globbed when they end up in the record.
+    if expand in ["outputs", "both"]:
         globbed["outputs"].expand(refresh=True)
-        if expand in ["outputs", "both"]:
-            slurm_run_info["outputs"] = globbed["outputs"].paths
-            # add the slurm outputs and environment files
-            # these are not captured in the initial globbing
-            slurm_run_info["outputs"].extend(slurm_outputs)
+        slurm_run_info["outputs"] = globbed["outputs"].paths
+        # add the slurm outputs and environment files
+        # these are not captured in the initial globbing
+        slurm_run_info["outputs"].extend(slurm_outputs)
 
     # abbreviate version of the command for illustrative purposes
     cmd_shorty = _format_cmd_shorty(cmd_expanded)
@@ -750,41 +827,50 @@ def check_output_conflict(dset, outputs, output_prefixes):
         Dataset object containing repository information.
     outputs : list of str
         List of strings representing output paths to check.
+    output_prefixes : list of str
+        List of the parent directories of the outputs.
 
     Returns
     -------
-    list
-        List of slurm_job_ids that have conflicting outputs.
-        Empty list if no conflicts or if database error occurs.
+    tuple
+        (bool, bool): whether there is a conflict with the outputs of a
+        scheduled job, and whether the database could be queried.
+        (None, None) if the connection to the database could not be
+        established.
     """
     # Connect to database
     con, cur = connect_to_database(dset, row_factory=True)
     if not con or not cur:
         return None, None
 
-    # Get all existing outputs from database
+    # the paths are passed as a single json array, so that the lookups use
+    # the indexes on the locked names and prefixes instead of reading all of
+    # them
     try:
         # first check the CURRENT NAMES against PRIOR PREFIXES
-        cur.execute("SELECT prefix FROM locked_prefixes")
-        existing_prefixes = cur.fetchall()
-        has_match = bool(set(existing_prefixes) & set(outputs))
-        if has_match:
-            return True, True
-
-        # now check CURRENT PREFIXES and against PRIOR NAMES
-        cur.execute("SELECT name FROM locked_names")
-        existing_names = cur.fetchall()
-        has_match = bool(set(existing_names) & set(output_prefixes))
-        if has_match:
+        cur.execute(
+            "SELECT 1 FROM locked_prefixes "
+            "WHERE prefix IN (SELECT value FROM json_each(?)) LIMIT 1",
+            (json_dumps(list(outputs)),),
+        )
+        if cur.fetchone():
             return True, True
 
-        # now check CURRENT NAMES and against PRIOR NAMES
-        has_match = bool(set(existing_names) & set(outputs))
-        if has_match:
+        # now check CURRENT PREFIXES and CURRENT NAMES against PRIOR NAMES
+        cur.execute(
+            "SELECT 1 FROM locked_names "
+            "WHERE name IN (SELECT value FROM json_each(?)) LIMIT 1",
+            (json_dumps(list(output_prefixes) + list(outputs)),),
+        )
+        if cur.fetchone():
             return True, True
 
     except sqlite3.Error:
         return False, True
+    finally:
+        # the connection is only needed for the check, it is not kept open
+        # while the job is submitted
+        con.close()
     return False, True
 
 
@@ -849,59 +935,37 @@ def get_slurm_output_files(job_id):
     ValueError
         If required file paths cannot be found in scontrol output.
     """
-    # Run scontrol command and get output
-    try:
-        result = subprocess.run(
-            ["scontrol", "show", "job", str(job_id)],
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-    except subprocess.CalledProcessError as e:
-        raise subprocess.CalledProcessError(
-            e.returncode, e.cmd, f"Failed to get job information: {e.output}"
-        )
-
-    # Parse output to find StdOut and StdErr
-    parsed_data = parse_slurm_output(result.stdout)
+    parsed_data = _show_job(job_id)
     if "ArrayJobId" in parsed_data:
         array_task_id = parsed_data["ArrayTaskId"]
         slurm_job_ids = generate_array_job_names(str(job_id), str(array_task_id))
+        # the output files of every task have to be queried separately, the
+        # queries only wait for the controller, so a few are run in parallel
+        workers = min(_SCONTROL_WORKERS, len(slurm_job_ids)) or 1
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            tasks_data = list(executor.map(_show_job, slurm_job_ids))
     else:
-        slurm_job_ids = [job_id]
+        # those of a single job are already known
+        tasks_data = [parsed_data]
 
+    # the paths are kept as strings, relative to the working directory
+    cwd = os.getcwd()
     slurm_out_paths = []
-    for i, slurm_job_id in enumerate(slurm_job_ids):
-        # Run scontrol command and get output
-        try:
-            result = subprocess.run(
-                ["scontrol", "show", "job", str(slurm_job_id)],
-                capture_output=True,
-                text=True,
-                check=True,
-            )
-        except subprocess.CalledProcessError as e:
-            raise subprocess.CalledProcessError(
-                e.returncode, e.cmd, f"Failed to get job information: {e.output}"
-            )
-
-        # Parse output to find StdOut and StdErr
-        parsed_data = parse_slurm_output(result.stdout)
-
+    for i, parsed_data in enumerate(tasks_data):
         stdout_path = parsed_data.get("StdOut")
         stderr_path = parsed_data.get("StdErr")
 
         if not stdout_path or not stderr_path:
             raise ValueError("Could not find StdOut or StdErr paths in scontrol output")
-        cwd = Path.cwd()
-        stdout_path = Path(stdout_path)
-        stderr_path = Path(stderr_path)
 
         if i == 0:
             # Write parsed data to JSON file
-            slurm_env_file = stdout_path.parent / f"slurm-job-{job_id}.env.json"
+            slurm_env_file = op.join(
+                op.dirname(stdout_path), f"slurm-job-{job_id}.env.json"
+            )
+            # encoded in one go, json.dump would issue a write per token
             with open(slurm_env_file, "w") as f:
-                json.dump(parsed_data, f, indent=2)
+                f.write(json.dumps(parsed_data, indent=2))
             rel_slurmenv = os.path.relpath(slurm_env_file, cwd)
 
         # Get relative paths
@@ -918,6 +982,28 @@ def get_slurm_output_files(job_id):
     return slurm_out_paths, rel_slurmenv
 
 
+def _show_job(job_id):
+    """Return the parsed output of `scontrol show job` for a job id
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If scontrol command fails.
+    """
+    try:
+        result = subprocess.run(
+            ["scontrol", "show", "job", str(job_id)],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except subprocess.CalledProcessError as e:
+        raise subprocess.CalledProcessError(
+            e.returncode, e.cmd, f"Failed to get job information: {e.output}"
+        )
+    return parse_slurm_output(result.stdout)
+
+
 def parse_slurm_output(output):
     """
     Parse SLURM output into a dictionary, handling space-separated assignments.
@@ -934,17 +1020,11 @@ def parse_slurm_output(output):
         excluding keys such as 'UserId' and 'JobId' for privacy purposes.
     """
     result = {}
-    # TODO Is this necessary for privacy purposes?
-    # What is useful to oneself vs for the community when pushing to git
-    excluded_keys = {"UserId", "JobId"}
-    for line in output.split("\n"):
-        # Split line into space-separated parts
-        parts = line.strip().split()
-        for part in parts:
-            if "=" in part:
-                key, value = part.split("=", 1)
-                if key not in excluded_keys:
-                    result[key] = value
+    # a single split over all lines, assignments never contain whitespace
+    for part in output.split():
+        key, sep, value = part.partition("=")
+        if sep and key not in _EXCLUDED_SLURM_KEYS:
+            result[key] = value
     return result
 
 
@@ -970,6 +1050,8 @@ def generate_array_job_names(job_id, job_task_id):
     ['12345_1', '12345_2', '12345_3']
     """
     job_names = []
+    # the common part of all the names, formatted only once
+    prefix = f"{job_id}_"
 
     # Remove any % limitations if present
     if "%" in job_task_id:
@@ -981,7 +1063,7 @@ def generate_array_job_names(job_id, job_task_id):
     for range_spec in ranges:
         # Handle individual numbers
         if "-" not in range_spec:
-            job_names.append(f"{job_id}_{range_spec}")
+            job_names.append(prefix + range_spec)
             continue
 
         # Handle ranges with optional step
@@ -989,8 +1071,7 @@ def generate_array_job_names(job_id, job_task_id):
         start, end = map(int, range_parts[0].split("-"))
         step = int(range_parts[1]) if len(range_parts) > 1 else 1
 
-        for i in range(start, end + 1, step):
-            job_names.append(f"{job_id}_{i}")
+        job_names.extend([prefix + str(i) for i in range(start, end + 1, step)])
 
     return job_names
 
@@ -1031,38 +1112,15 @@ def add_to_database(dset, slurm_run_info, message, outputs, prefixes):
     if not cur or not con:
         return None
 
-    # create an empty table if it doesn't exist
-    cur.execute(
-        """
-    CREATE TABLE IF NOT EXISTS open_jobs (
-    slurm_job_id INTEGER,
-    message TEXT,
-    chain TEXT CHECK (json_valid(chain)),
-    cmd TEXT,
-    dsid TEXT,
-    inputs TEXT CHECK (json_valid(inputs)),
-    extra_inputs TEXT CHECK (json_valid(extra_inputs)),
-    outputs TEXT CHECK (json_valid(outputs)),
-    slurm_outputs TEXT CHECK (json_valid(slurm_outputs)),
-    pwd TEXT
+    # the list columns are stored as json, the others as they are
+    row = {column: json_dumps(slurm_run_info[column]) for column in JSON_COLUMNS}
+    row.update(
+        slurm_job_id=slurm_run_info["slurm_job_id"],
+        message=message,
+        cmd=slurm_run_info["cmd"],
+        dsid=slurm_run_info["dsid"],
+        pwd=slurm_run_info["pwd"],
     )
-    """
-    )
-
-    # convert the inputs to json
-    inputs_json = json.dumps(slurm_run_info["inputs"])
-
-    # convert the extra inputs to json
-    extra_inputs_json = json.dumps(slurm_run_info["extra_inputs"])
-
-    # convert the outputs to json
-    outputs_json = json.dumps(slurm_run_info["outputs"])
-
-    # convert the slurm outputs to json
-    slurm_outputs_json = json.dumps(slurm_run_info["slurm_outputs"])
-
-    # convert chain to json
-    chain_json = json.dumps(slurm_run_info["chain"])
 
     # add the most recent schedule command to the table
     cur.execute(
@@ -1077,60 +1135,33 @@ def add_to_database(dset, slurm_run_info, message, outputs, prefixes):
     outputs,
     slurm_outputs,
     pwd)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    VALUES (:slurm_job_id, :message, :chain, :cmd, :dsid,
+    :inputs, :extra_inputs, :outputs, :slurm_outputs, :pwd)
     """,
-        (
-            slurm_run_info["slurm_job_id"],
-            message,
-            chain_json,
-            slurm_run_info["cmd"],
-            slurm_run_info["dsid"],
-            inputs_json,
-            extra_inputs_json,
-            outputs_json,
-            slurm_outputs_json,
-            slurm_run_info["pwd"],
-        ),
-    )
-
-    # now create the tables with the locked_prefixes and locked_names
-    cur.execute(
-        """
-    CREATE TABLE IF NOT EXISTS locked_prefixes (
-    slurm_job_id INTEGER,
-    prefix TEXT )
-    """
+        row,
     )
 
-    cur.execute(
+    # lock all the outputs and their prefixes at once
+    job_id = slurm_run_info["slurm_job_id"]
+    cur.executemany(
         """
-    CREATE TABLE IF NOT EXISTS locked_names (
-    slurm_job_id INTEGER,
-    name TEXT )
-    """
+    INSERT INTO locked_names (slurm_job_id,
+    name)
+    VALUES (?, ?)
+    """,
+        [(job_id, output.rstrip("/")) for output in outputs],
     )
 
-    for output in outputs:
-        cur.execute(
+    if prefixes:
+        cur.executemany(
             """
-        INSERT INTO locked_names (slurm_job_id,
-        name)
+        INSERT INTO locked_prefixes (slurm_job_id,
+        prefix)
         VALUES (?, ?)
         """,
-            (slurm_run_info["slurm_job_id"], output.rstrip("/")),
+            [(job_id, prefix) for prefix in prefixes],
         )
 
-    if prefixes:
-        for prefix in prefixes:
-            cur.execute(
-                """
-            INSERT INTO locked_prefixes (slurm_job_id,
-            prefix)
-            VALUES (?, ?)
-            """,
-                (slurm_run_info["slurm_job_id"], prefix),
-            )
-
     # save and close
     con.commit()
     con.close()
@@ -0,0 +1,90 @@
+import subprocess
+
+from datalad_slurm import finish
+from datalad_slurm.finish import (
+    expand_outputs,
+    get_job_status,
+    get_job_statuses_bulk,
+)
+
+
+def test_get_job_statuses_bulk(monkeypatch):
+    sacct_output = (
+        "101|COMPLETED\n"
+        "102_1|COMPLETED\n"
+        "102_2|FAILED\n"
+        "103_[1-4]|PENDING\n"
+        "104|CANCELLED by 1000\n"
+    )
+    squeue_output = "105|RUNNING\n"
+    calls = []
+
+    def fake_run(cmd, **kwargs):
+        calls.append(cmd)
+        output = squeue_output if cmd[0] == "squeue" else sacct_output
+        return subprocess.CompletedProcess(cmd, 0, stdout=output)
+
+    monkeypatch.setattr(subprocess, "run", fake_run)
+    statuses = get_job_statuses_bulk([101, "102", 103, 104, 105, "invalid"])
+
+    # a single squeue call for all valid job ids, and a single sacct call for
+    # the jobs which are no longer known to the controller
+    assert [cmd[0] for cmd in calls] == ["squeue", "sacct"]
+    assert "101,102,103,104,105" in calls[0]
+    assert "101,102,103,104" in calls[1]
+    assert statuses == {
+        "101": ({"101": "COMPLETED"}, "COMPLETED"),
+        "102": (
+            {"102_1": "COMPLETED", "102_2": "FAILED"},
+            "ARRAY FAILED (SOME COMPLETE)",
+        ),
+        "103": ({"103_[1-4]": "PENDING"}, "PENDING"),
+        "104": ({"104": "CANCELLED"}, "CANCELLED"),
+        "105": ({"105": "RUNNING"}, "RUNNING"),
+    }
+
+
+def test_get_job_status_squeue_states(monkeypatch):
+    squeue_output = "101|COMPLETING\n102_1|COMPLETED\n102_3|COMPLETED\n"
+    # task 102_2 was already purged from the controller
+    sacct_output = "102_1|COMPLETED\n102_2|FAILED\n102_3|COMPLETED\n"
+    calls = []
+
+    def fake_run(cmd, **kwargs):
+        calls.append(cmd[0])
+        output = squeue_output if cmd[0] == "squeue" else sacct_output
+        return subprocess.CompletedProcess(cmd, 0, stdout=output)
+
+    monkeypatch.setattr(subprocess, "run", fake_run)
+
+    # a job which is just finishing is still active, not failed
+    assert get_job_status(101) == ({"101": "COMPLETING"}, "COMPLETING")
+    assert finish._STATE_CLASS["COMPLETING"] == finish._STATE_ACTIVE
+    assert calls == ["squeue"]
+
+    # an array without active tasks is looked up in the accounting database
+    assert get_job_status(102) == (
+        {"102_1": "COMPLETED", "102_2": "FAILED", "102_3": "COMPLETED"},
+        "ARRAY FAILED (SOME COMPLETE)",
+    )
+    assert calls == ["squeue", "squeue", "sacct"]
+    assert get_job_statuses_bulk([102])["102"][1] == "ARRAY FAILED (SOME COMPLETE)"
+
+
+def test_expand_outputs(tmp_path, monkeypatch):
+    for name in ("a.txt", "b.txt"):
+        (tmp_path / name).write_text(name)
+    monkeypatch.chdir(tmp_path)
+
+    # absolute paths are made relative, with or without wildcards
+    cache = {}
+    assert expand_outputs(
+        [str(tmp_path / "a.txt"), "missing.txt", str(tmp_path / "*.txt")],
+        cache=cache,
+    ) == ["a.txt", "missing.txt", "a.txt", "b.txt"]
+    assert list(cache) == [("*.txt", str(tmp_path))]
+
+    # the cache is only used by the calls it is passed to
+    (tmp_path / "c.txt").write_text("c")
+    assert expand_outputs(["*.txt"], cache=cache) == ["a.txt", "b.txt"]
+    assert expand_outputs(["*.txt"]) == ["a.txt", "b.txt", "c.txt"]
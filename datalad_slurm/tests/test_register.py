@@ -1,8 +1,8 @@
 from datalad.tests.utils_pytest import assert_result_count
 import datalad.support.exceptions as dl_exceptions
+import datalad.api as da
 
 def test_register():
-    import datalad.api as da
     assert hasattr(da, 'schedule')
     assert hasattr(da, 'finish')
     assert hasattr(da, 'reschedule')
@@ -0,0 +1,91 @@
+import os.path as op
+
+from datalad.distribution.dataset import Dataset
+from datalad.support.gitrepo import GitRepo
+
+from datalad_slurm.reschedule import (
+    _describe_commits,
+    _get_head_info,
+    diff_revision,
+    new_or_modified,
+)
+
+
+def _states(diff_results, root):
+    return {
+        op.relpath(r["path"], root): (r["type"], r["state"]) for r in diff_results
+    }
+
+
+def test_diff_revision(tmp_path):
+    ds = Dataset(tmp_path / "ds").create(annex=False)
+    root = ds.path
+
+    # the root commit is compared with the empty tree
+    root_commit = ds.repo.get_revisions()[-1]
+    states = _states(diff_revision(ds, root_commit), root)
+    assert states
+    assert {state for _, state in states.values()} == {"added"}
+
+    (ds.pathobj / "a.txt").write_text("a")
+    (ds.pathobj / "b.txt").write_text("b")
+    ds.save()
+    (ds.pathobj / "a.txt").write_text("changed")
+    (ds.pathobj / "b.txt").unlink()
+    (ds.pathobj / "c.txt").write_text("c")
+    ds.save()
+
+    results = list(diff_revision(ds))
+    assert _states(results, root) == {
+        "a.txt": ("file", "modified"),
+        "b.txt": ("file", "deleted"),
+        "c.txt": ("file", "added"),
+    }
+    deleted = [r for r in results if r["state"] == "deleted"][0]
+    assert deleted["gitshasum"] is None
+    assert deleted["prev_gitshasum"]
+    assert sorted(
+        op.relpath(r["path"], root) for r in new_or_modified(results)
+    ) == ["a.txt", "c.txt"]
+
+
+def test_diff_revision_subdataset(tmp_path):
+    ds = Dataset(tmp_path / "ds").create(annex=False)
+    sub = ds.create("sub", annex=False)
+    (sub.pathobj / "x.txt").write_text("x")
+    ds.save(recursive=True)
+
+    # the changes within the subdataset are reported as well
+    assert _states(diff_revision(ds), ds.path) == {
+        "sub": ("dataset", "modified"),
+        op.join("sub", "x.txt"): ("file", "added"),
+    }
+
+
+def test_get_head_info(tmp_path):
+    assert _get_head_info(GitRepo(tmp_path / "empty", create=True)) == (None, None)
+
+    ds = Dataset(tmp_path / "ds").create(annex=False)
+    hexsha = ds.repo.get_hexsha()
+    assert _get_head_info(ds.repo) == (hexsha, ds.repo.get_active_branch())
+
+    ds.repo.checkout(hexsha, options=["--detach"])
+    assert _get_head_info(ds.repo) == (hexsha, None)
+
+
+def test_describe_commits(tmp_path):
+    ds = Dataset(tmp_path / "ds").create(annex=False)
+    for name in ("a.txt", "b.txt"):
+        (ds.pathobj / name).write_text(name)
+        ds.save()
+    untagged, tagged, head = ds.repo.get_revisions()[2::-1]
+    # git describe only uses annotated tags by default
+    ds.repo.tag("v1", message="Version 1", commit=tagged)
+
+    # commits before the tag can only be described by their own hexsha, and
+    # are left out
+    assert _describe_commits(ds.repo, [untagged, tagged, head]) == {
+        tagged: "v1",
+        head: "v1-1-g" + ds.repo.get_hexsha(head, short=True),
+    }
+    assert _describe_commits(ds.repo, []) == {}
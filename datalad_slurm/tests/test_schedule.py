@@ -0,0 +1,104 @@
+import os
+
+from datalad.distribution.dataset import Dataset
+
+from datalad_slurm.schedule import (
+    _execute_slurm_command,
+    _parse_submitted_job_id,
+    add_to_database,
+    check_output_conflict,
+    get_sub_paths,
+)
+
+
+def test_parse_submitted_job_id():
+    assert _parse_submitted_job_id("Submitted batch job 123456\n") == "123456"
+    # warnings of sbatch come before the job id
+    assert (
+        _parse_submitted_job_id(
+            "sbatch: warning: no memory requested\nSubmitted batch job 42"
+        )
+        == "42"
+    )
+    assert _parse_submitted_job_id("Submitted batch job 42 on cluster c1") == "42"
+    assert _parse_submitted_job_id("Submitted batch job ?") is None
+    assert _parse_submitted_job_id("sbatch: error: invalid partition") is None
+    assert _parse_submitted_job_id("") is None
+
+
+def test_execute_slurm_command(tmp_path, monkeypatch):
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    sbatch = bindir / "sbatch"
+    # prints the job id alone with --parsable, like sbatch does
+    sbatch.write_text(
+        "#!/bin/sh\n"
+        'echo "$@" > "$(dirname "$0")/args"\n'
+        'for arg; do [ "$arg" = bad.sh ] && { echo "sbatch: error: bad" >&2; exit 1; }; done\n'
+        'if [ "$1" = --parsable ]; then echo "4242;cluster"; exit 0; fi\n'
+        "echo 'sbatch: warning: no memory requested'\n"
+        "echo 'Submitted batch job 4243'\n"
+    )
+    sbatch.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bindir}{os.pathsep}{os.environ['PATH']}")
+
+    # a plain sbatch call is run with --parsable before the script
+    assert _execute_slurm_command("sbatch job.sh arg", str(tmp_path)) == (
+        0,
+        None,
+        "4242",
+    )
+    assert (bindir / "args").read_text() == "--parsable job.sh arg\n"
+
+    # anything else goes through the shell, and the output of sbatch is parsed
+    assert _execute_slurm_command("sbatch job.sh | cat", str(tmp_path)) == (
+        0,
+        None,
+        "4243",
+    )
+    assert (bindir / "args").read_text() == "job.sh\n"
+
+    # a comment is left to the shell, rather than passed on to sbatch
+    assert _execute_slurm_command("sbatch job.sh  # note", str(tmp_path)) == (
+        0,
+        None,
+        "4243",
+    )
+    assert (bindir / "args").read_text() == "job.sh\n"
+
+    # a failed submission has no job id, and keeps its exit code
+    assert _execute_slurm_command("sbatch bad.sh", str(tmp_path)) == (1, None, None)
+    assert _execute_slurm_command("sbatch bad.sh && true", str(tmp_path)) == (
+        1,
+        None,
+        None,
+    )
+
+
+def test_check_output_conflict(tmp_path):
+    ds = Dataset(tmp_path / "ds").create(annex=False)
+    outputs = ["out/a/result.txt"]
+    slurm_run_info = {
+        "slurm_job_id": 1,
+        "chain": [],
+        "cmd": "sbatch job.sh",
+        "dsid": ds.id,
+        "inputs": [],
+        "extra_inputs": [],
+        "outputs": outputs,
+        "slurm_outputs": [],
+        "pwd": ".",
+    }
+    assert add_to_database(ds, slurm_run_info, "msg", outputs, get_sub_paths(outputs))
+
+    def check(*outputs):
+        return check_output_conflict(ds, list(outputs), get_sub_paths(outputs))
+
+    # a new output is a parent directory of a scheduled output
+    assert check("out/a") == (True, True)
+    # a scheduled output is a parent directory of a new output
+    assert check("out/a/result.txt/part") == (True, True)
+    # the same output is scheduled again
+    assert check("out/a/result.txt") == (True, True)
+    # outputs next to the scheduled one, or elsewhere
+    assert check("out/a/other.txt", "out/b/result.txt") == (False, True)